@@ -7,8 +7,17 @@ Conversor CNAB para Excel - UY3
 import os
 import sys
 import re
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 
+try:
+    import xlsxwriter
+except ImportError:
+    print("❌ Erro: biblioteca xlsxwriter não encontrada")
+    sys.exit(1)
+
 # Detectar pasta onde o .exe está (não a pasta temporária)
 if getattr(sys, 'frozen', False):
     # Executando como .exe
@@ -20,9 +29,7 @@ else:
 PASTA_CNAB = os.path.join(PASTA_BASE, "CNABs")
 PASTA_SAIDA = os.path.join(PASTA_BASE, "Convertidos")
 
-
-def banner():
-    print("""
+_BANNER = """
 ╔══════════════════════════════════════════════════════════════════╗
 ║                                                                  ║
 ║   ██████╗███╗   ██╗ █████╗ ██████╗                              ║
@@ -35,7 +42,52 @@ def banner():
 ║           CONVERSOR DE ARQUIVOS CNAB - UY3                       ║
 ║                                                                  ║
 ╚══════════════════════════════════════════════════════════════════╝
-""")
+"""
+
+# Estilos do Excel (propriedades dos formatos; cada workbook cria o seu uma única vez)
+_FMT_CABECALHO = {
+    'bold': True,
+    'font_color': '#FFFFFF',
+    'bg_color': '#4472C4',
+    'align': 'center',
+    'valign': 'vcenter',
+    'border': 1
+}
+_FMT_DADOS = {'valign': 'vcenter', 'border': 1}
+# Valor total gravado como número (permite somar/filtrar no Excel), exibido como moeda
+_FMT_VALOR = dict(_FMT_DADOS, num_format='"R$" #,##0.00')
+
+# Tabela para str.translate que remove tudo que não é dígito (arquivo lido em latin-1)
+_KEEP_DIGITS = str.maketrans('', '', ''.join(c for c in map(chr, range(256)) if c not in '0123456789'))
+
+# Regex pré-compiladas usadas em parse_cnab_linha
+# (_RE_VALOR só é usada quando o campo de valor não está na posição esperada)
+_RE_VALOR = re.compile(r'0{5,}(\d+?)457')
+_RE_CEP = re.compile(r'\d{8}')
+# Garantir que o email comece com letra, não com número
+_RE_EMAIL = re.compile(r'[a-zA-Z][a-zA-Z0-9._%+-]*@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+
+# Posições fixas dos campos no layout CNAB 400 - UY3/Bradesco
+_SL_ID = slice(108, 122)         # ID do título com parcela - formato: 2104757146-027
+_SL_VALOR = slice(126, 139)      # Valor do título em centavos (13 dígitos)
+_SL_DOC = slice(220, 234)        # CPF/CNPJ
+_SL_NOME = slice(234, 274)       # Nome do cliente
+_SL_ENDERECO = slice(274, 326)   # Endereço
+_SL_CEP = slice(310, 340)        # Região onde o CEP (8 dígitos) é buscado
+_SL_EMAIL = slice(326, 385)      # Região do email (evitar CEP no início)
+_SL_TELEFONE = slice(382, 394)   # Telefone
+
+# Caches de formatação por valor bruto: o mesmo cliente aparece uma vez por parcela
+_cache_cpf_cnpj = {}
+_cache_cep = {}
+_cache_telefone = {}
+
+# Registro de detalhe extraído de uma linha CNAB
+Registro = namedtuple('Registro', 'nome cpf_cnpj valor_centavos id_titulo endereco cep email telefone')
+
+
+def banner():
+    print(_BANNER)
 
 
 def garantir_pastas():
@@ -51,12 +103,9 @@ def garantir_pastas():
 
 def listar_arquivos_cnab():
     """Lista arquivos CNAB na pasta"""
-    arquivos = []
-    for f in os.listdir(PASTA_CNAB):
-        caminho = os.path.join(PASTA_CNAB, f)
-        if os.path.isfile(caminho):
-            arquivos.append(caminho)
-    return arquivos
+    # scandir reaproveita o tipo de cada entrada do diretório (sem stat() extra por arquivo)
+    with os.scandir(PASTA_CNAB) as entradas:
+        return [entrada.path for entrada in entradas if entrada.is_file()]
 
 
 def parse_valor(valor_str):
@@ -66,7 +115,7 @@ def parse_valor(valor_str):
         if not valor_str:
             return 0.0
         # Limpar caracteres não numéricos e converter
-        valor_limpo = re.sub(r'\D', '', valor_str)
+        valor_limpo = valor_str.translate(_KEEP_DIGITS)
         if not valor_limpo or valor_limpo == '0':
             return 0.0
         valor = int(valor_limpo) / 100.0
@@ -77,12 +126,22 @@ def parse_valor(valor_str):
 
 def numero_para_valor(numero):
     """Converte número para formato 'R$ X.XXX,XX'"""
-    return f"R$ {numero:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    centavos = int(round(numero * 100))
+    sinal = '-' if centavos < 0 else ''
+    inteiro, fracao = divmod(abs(centavos), 100)
+    # Inserir separador de milhar (.) a cada 3 dígitos da direita para a esquerda
+    digitos = str(inteiro)
+    grupos = []
+    while len(digitos) > 3:
+        grupos.append(digitos[-3:])
+        digitos = digitos[:-3]
+    grupos.append(digitos)
+    return f"R$ {sinal}{'.'.join(reversed(grupos))},{fracao:02d}"
 
 
 def formatar_cpf_cnpj(doc):
     """Formata CPF (sempre 11 dígitos)"""
-    doc = re.sub(r'\D', '', doc)
+    doc = doc.translate(_KEEP_DIGITS)
     # Pegar apenas os últimos 11 dígitos se tiver mais
     if len(doc) > 11:
         doc = doc[-11:]
@@ -95,7 +154,7 @@ def formatar_cpf_cnpj(doc):
 
 def formatar_cep(cep):
     """Formata CEP"""
-    cep = re.sub(r'\D', '', cep)
+    cep = cep.translate(_KEEP_DIGITS)
     if len(cep) == 8:
         return f"{cep[:5]}-{cep[5:]}"
     return cep
@@ -103,7 +162,7 @@ def formatar_cep(cep):
 
 def formatar_telefone(tel):
     """Formata telefone"""
-    tel = re.sub(r'\D', '', tel)
+    tel = tel.translate(_KEEP_DIGITS)
     if len(tel) == 11:
         return f"({tel[:2]}) {tel[2:7]}-{tel[7:]}"
     elif len(tel) == 10:
@@ -111,210 +170,154 @@ def formatar_telefone(tel):
     return tel
 
 
+def extrair_id_titulo(linha):
+    """Extrai o número da operação de uma linha CNAB (sem prefixo 210 e sem sufixo -027)"""
+    # ID do título com parcela - formato: 2104757146-027
+    id_titulo = linha[_SL_ID].strip()
+    if id_titulo[:3] == '210':
+        id_titulo = id_titulo[3:]
+    hifen = id_titulo.find('-')
+    if hifen >= 0:
+        id_titulo = id_titulo[:hifen]
+    return id_titulo
+
+
+def extrair_valor_centavos(linha):
+    """Extrai o valor do título de uma linha CNAB, em centavos"""
+    # Valor do título (posições 126-139)
+    valor_raw = linha[_SL_VALOR]
+    if valor_raw.isascii() and valor_raw.isdigit():
+        return int(valor_raw)
+    # Fallback: buscar padrão na linha inteira: múltiplos zeros seguidos de dígitos e terminando em 457
+    valor_match = _RE_VALOR.search(linha)
+    if valor_match:
+        return int(valor_match.group(1))
+    return 0
+
+
 def parse_cnab_linha(linha):
     """Parse de uma linha CNAB 400 - Layout UY3/Bradesco"""
     if len(linha) < 400:
         return None
     
-    tipo_registro = linha[0:1]
-    
     # Só processar registros de detalhe (tipo 1)
-    if tipo_registro != '1':
+    if linha[0] != '1':
         return None
     
-    # ID do título com parcela (posições 108-122) - formato: 2104757146-027
-    id_titulo_parcela = linha[108:122].strip()
+    id_titulo = extrair_id_titulo(linha)
     
-    # Extrair apenas o número do meio (remover prefixo 210 e sufixo -027)
-    id_titulo = id_titulo_parcela
-    
-    # Remover prefixo "210" se existir
-    if id_titulo.startswith('210'):
-        id_titulo = id_titulo[3:]
+    nome = linha[_SL_NOME].strip()
     
-    # Remover sufixo após hífen (ex: -027)
-    if '-' in id_titulo:
-        partes = id_titulo.split('-')
-        id_titulo = partes[0]
+    # formatar_cpf_cnpj já descarta espaços, não precisa de strip()
+    cpf_cnpj_raw = linha[_SL_DOC]
+    cpf_cnpj = _cache_cpf_cnpj.get(cpf_cnpj_raw)
+    if cpf_cnpj is None:
+        cpf_cnpj = _cache_cpf_cnpj[cpf_cnpj_raw] = formatar_cpf_cnpj(cpf_cnpj_raw)
     
-    # Nome do cliente (posições 234-274)
-    nome = linha[234:274].strip()
+    # Mantido em centavos inteiros; a conversão para reais é feita uma vez por operação
+    valor_centavos = extrair_valor_centavos(linha)
     
-    # CPF/CNPJ (posições 220-234)
-    cpf_cnpj_raw = linha[220:234].strip()
-    cpf_cnpj = formatar_cpf_cnpj(cpf_cnpj_raw)
-    
-    # Valor - buscar padrão: zeros + valor_em_centavos + 457
-    valor = 0.0
-    # Buscar padrão na linha inteira: múltiplos zeros seguidos de dígitos e terminando em 457
-    valor_match = re.search(r'0{5,}(\d+?)457', linha)
-    if valor_match:
-        valor_centavos = valor_match.group(1)
-        valor = int(valor_centavos) / 100.0
-    
-    # Endereço (posições 274-326)
-    endereco = linha[274:326].strip()
+    endereco = linha[_SL_ENDERECO].strip()
     
     # CEP - buscar 8 dígitos na região 310-340
     cep = ""
-    cep_region = linha[310:340]
-    cep_match = re.search(r'\d{8}', cep_region)
+    cep_match = _RE_CEP.search(linha[_SL_CEP])
     if cep_match:
-        cep = formatar_cep(cep_match.group())
+        cep_raw = cep_match.group()
+        cep = _cache_cep.get(cep_raw)
+        if cep is None:
+            cep = _cache_cep[cep_raw] = formatar_cep(cep_raw)
     
     # Email - buscar padrão de email na região 326-385 (evitar CEP no início)
     email = ""
-    email_region = linha[326:385]
-    # Garantir que o email comece com letra, não com número
-    email_match = re.search(r'[a-zA-Z][a-zA-Z0-9._%+-]*@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', email_region)
+    email_match = _RE_EMAIL.search(linha[_SL_EMAIL])
     if email_match:
         email = email_match.group().lower()
     
-    # Telefone (posições 382-394)
-    telefone_raw = linha[382:394].strip()
-    telefone = formatar_telefone(telefone_raw)
+    telefone_raw = linha[_SL_TELEFONE]
+    telefone = _cache_telefone.get(telefone_raw)
+    if telefone is None:
+        telefone = _cache_telefone[telefone_raw] = formatar_telefone(telefone_raw)
     
-    return {
-        'nome': nome,
-        'cpf_cnpj': cpf_cnpj,
-        'valor': valor,
-        'id_titulo': id_titulo,  # Usar ID limpo (sem prefixo 210 e sem sufixo -027)
-        'endereco': endereco,
-        'cep': cep,
-        'email': email,
-        'telefone': telefone
-    }
+    return Registro(nome, cpf_cnpj, valor_centavos, id_titulo, endereco, cep, email, telefone)
 
 
 def processar_arquivo(caminho_cnab):
     """Processa um arquivo CNAB e gera Excel"""
+    # Ler arquivo CNAB linha a linha e agrupar por operação em uma única passada
+    # (usando id_titulo como chave única).
+    # CNAB é ASCII + acentos latin-1; como todo byte é válido em latin-1, a
+    # leitura nunca falha por codificação e não há outras a tentar.
+    operacoes_agrupadas = {}
+    total_parcelas = 0
     try:
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-    except ImportError:
-        print("❌ Erro: biblioteca openpyxl não encontrada")
-        return False
-    
-    # Ler arquivo CNAB
-    registros = []
-    encodings = ['latin-1', 'utf-8', 'cp1252']
-    
-    for enc in encodings:
-        try:
-            with open(caminho_cnab, 'r', encoding=enc) as f:
-                linhas = f.readlines()
-            break
-        except:
-            continue
-    else:
+        with open(caminho_cnab, 'r', encoding='latin-1') as f:
+            for linha in f:
+                # Só processar registros de detalhe (tipo 1) com o layout completo
+                if len(linha) < 400 or linha[0] != '1':
+                    continue
+                total_parcelas += 1
+                id_titulo = extrair_id_titulo(linha)
+                operacao = operacoes_agrupadas.get(id_titulo)
+                if operacao is None:
+                    # Primeira ocorrência: parse completo, entrada já na ordem das colunas do Excel
+                    # [nome, cpf_cnpj, parcelas, valor_total_centavos, id_titulo, endereco, cep, email, telefone]
+                    reg = parse_cnab_linha(linha)
+                    operacoes_agrupadas[id_titulo] = [
+                        reg.nome, reg.cpf_cnpj, 1, reg.valor_centavos, reg.id_titulo,
+                        reg.endereco, reg.cep, reg.email, reg.telefone
+                    ]
+                else:
+                    # Operação já existe: os dados do cliente se repetem em toda parcela,
+                    # basta incrementar parcelas e somar valor
+                    operacao[2] += 1
+                    operacao[3] += extrair_valor_centavos(linha)
+    except OSError:
         print(f"❌ Erro ao ler arquivo: {caminho_cnab}")
         return False
     
-    # Processar linhas
-    for linha in linhas:
-        if len(linha) >= 400:
-            reg = parse_cnab_linha(linha)
-            if reg:
-                registros.append(reg)
-    
-    if not registros:
+    if not operacoes_agrupadas:
         print(f"⚠️  Nenhum registro encontrado em: {os.path.basename(caminho_cnab)}")
         return False
     
-    # Agrupar registros por operação (usando id_titulo como chave única)
-    operacoes_agrupadas = {}
-    for reg in registros:
-        chave = reg['id_titulo']  # Usar número da operação como identificador único
-        
-        if chave not in operacoes_agrupadas:
-            # Primeira ocorrência: criar entrada
-            operacoes_agrupadas[chave] = {
-                'nome': reg['nome'],
-                'cpf_cnpj': reg['cpf_cnpj'],
-                'quantidade_parcelas': 1,
-                'valor_total': reg['valor'],  # Já é número float
-                'id_titulo': reg['id_titulo'],
-                'endereco': reg['endereco'],
-                'cep': reg['cep'],
-                'email': reg['email'],
-                'telefone': reg['telefone']
-            }
-        else:
-            # Operação já existe: incrementar parcelas e somar valor
-            operacoes_agrupadas[chave]['quantidade_parcelas'] += 1
-            operacoes_agrupadas[chave]['valor_total'] += reg['valor']  # Já é número float
-    
-    # Converter dicionário de volta para lista
-    registros_agrupados = []
-    for operacao in operacoes_agrupadas.values():
-        registros_agrupados.append({
-            'nome': operacao['nome'],
-            'cpf_cnpj': operacao['cpf_cnpj'],
-            'parcelas': str(operacao['quantidade_parcelas']),
-            'valor': numero_para_valor(operacao['valor_total']),
-            'id_titulo': operacao['id_titulo'],
-            'endereco': operacao['endereco'],
-            'cep': operacao['cep'],
-            'email': operacao['email'],
-            'telefone': operacao['telefone']
-        })
+    # Caminho de saída
+    nome_arquivo = os.path.splitext(os.path.basename(caminho_cnab))[0]
+    caminho_saida = os.path.join(PASTA_SAIDA, f"{nome_arquivo}.xlsx")
     
-    # Criar Excel
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Dados CNAB"
+    # Criar Excel (constant_memory: cada linha é gravada em disco assim que a próxima começa).
+    # Textos são gravados como estão, sem virar fórmula ou link.
+    wb = xlsxwriter.Workbook(caminho_saida, {
+        'constant_memory': True,
+        'strings_to_formulas': False,
+        'strings_to_urls': False
+    })
+    ws = wb.add_worksheet("Dados CNAB")
+    fmt_cabecalho = wb.add_format(_FMT_CABECALHO)
+    fmt_dados = wb.add_format(_FMT_DADOS)
+    fmt_valor = wb.add_format(_FMT_VALOR)
     
     # Cabeçalhos
     headers = ['Nome Cliente', 'CPF/CNPJ', 'Parcelas', 'Valor Total (Soma)', 'Nº da Operação', 'Endereco', 'CEP', 'Email', 'Telefone']
     
-    # Estilos
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_align = Alignment(horizontal="center", vertical="center")
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
+    # Ajustar largura das colunas
+    larguras = [35, 20, 10, 15, 20, 40, 12, 35, 18]
+    for col_idx, largura in enumerate(larguras):
+        ws.set_column(col_idx, col_idx, largura)
     
     # Escrever cabeçalhos
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_align
-        cell.border = thin_border
+    ws.write_row(0, 0, headers, fmt_cabecalho)
     
     # Escrever dados
-    for row_idx, reg in enumerate(registros_agrupados, 2):
-        valores = [
-            reg['nome'],
-            reg['cpf_cnpj'],
-            reg['parcelas'],
-            reg['valor'],
-            reg['id_titulo'],
-            reg['endereco'],
-            reg['cep'],
-            reg['email'],
-            reg['telefone']
-        ]
-        for col_idx, valor in enumerate(valores, 1):
-            cell = ws.cell(row=row_idx, column=col_idx, value=valor)
-            cell.border = thin_border
-            cell.alignment = Alignment(vertical="center")
-    
-    # Ajustar largura das colunas
-    larguras = [35, 20, 10, 15, 20, 40, 12, 35, 18]
-    for col_idx, largura in enumerate(larguras, 1):
-        ws.column_dimensions[chr(64 + col_idx)].width = largura
+    for row_idx, operacao in enumerate(operacoes_agrupadas.values(), 1):
+        operacao[2] = str(operacao[2])
+        ws.write_row(row_idx, 0, operacao[:3], fmt_dados)
+        ws.write_number(row_idx, 3, operacao[3] / 100.0, fmt_valor)
+        ws.write_row(row_idx, 4, operacao[4:], fmt_dados)
     
     # Salvar arquivo
-    nome_arquivo = os.path.splitext(os.path.basename(caminho_cnab))[0]
-    caminho_saida = os.path.join(PASTA_SAIDA, f"{nome_arquivo}.xlsx")
-    wb.save(caminho_saida)
+    wb.close()
     
-    print(f"    ✅ Excel gerado: {nome_arquivo}.xlsx ({len(registros_agrupados)} clientes, {len(registros)} parcelas totais)")
+    print(f"    ✅ Excel gerado: {nome_arquivo}.xlsx ({len(operacoes_agrupadas)} clientes, {total_parcelas} parcelas totais)")
     return True
 
 
@@ -336,12 +339,19 @@ def main():
     sucessos = 0
     falhas = 0
     
-    for i, arquivo in enumerate(arquivos, 1):
-        print(f"[{i}/{len(arquivos)}] Processando: {os.path.basename(arquivo)}")
-        if processar_arquivo(arquivo):
-            sucessos += 1
-        else:
-            falhas += 1
+    # Cada arquivo é independente: processar em paralelo, um processo por núcleo
+    max_workers = min(len(arquivos), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futuros = []
+        for i, arquivo in enumerate(arquivos, 1):
+            print(f"[{i}/{len(arquivos)}] Processando: {os.path.basename(arquivo)}")
+            futuros.append(executor.submit(processar_arquivo, arquivo))
+        
+        for futuro in as_completed(futuros):
+            if futuro.result():
+                sucessos += 1
+            else:
+                falhas += 1
     
     print(f"\n{'='*50}")
     print(f"RESUMO DO PROCESSAMENTO")
@@ -355,4 +365,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Necessário para o ProcessPoolExecutor funcionar no .exe gerado pelo PyInstaller
+    multiprocessing.freeze_support()
     main()